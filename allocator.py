@@ -1,122 +1,911 @@
-﻿import random
-from collections import defaultdict
+﻿import importlib.util
+import json
+import multiprocessing as mp
+import shutil
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import Alignment, Border, Font, Side
-from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.writer.excel import ExcelWriter
+
+from tracing import Tracer
 
 
 REQUIRED_STUDENT_COLUMNS = {'ИИН', 'Сыныбы', 'Тегі', 'Аты'}
+STUDENT_COLUMNS = ['ИИН', 'Сыныбы', 'Тегі', 'Аты']
 
+# Optional per-room columns of the rooms file; blank cells fall back to the global settings.
+ROOM_CAPACITY_COLUMN = 'Орын саны'
+ROOM_CLASS_CAP_COLUMN = 'Сынып шегі'
+ROOM_COLUMNS = {'Кабинет', ROOM_CAPACITY_COLUMN, ROOM_CLASS_CAP_COLUMN}
 
-def validate_inputs(rooms_df: pd.DataFrame, students_df: pd.DataFrame):
+# 'greedy' runs randomized restarts; 'flow' solves the class -> room max-flow exactly.
+SOLVERS = ('greedy', 'flow')
+# Default balancing budget (seconds) of every entry point: app, CLI, batch and desktop tool.
+REFINE_SECONDS = 1.0
+
+READY_COLUMNS = ['№', 'ИИН', 'Сыныбы', 'Тегі', 'Аты']
+# Reference file must contain exactly 4 columns: №, Сыныбы, Тегі, Аты
+REFERENCE_COLUMNS = ['№', 'Сыныбы', 'Тегі', 'Аты']
+# Flat one-row-per-student export for other systems.
+TABLE_COLUMNS = ['ИИН', 'Сыныбы', 'Тегі', 'Аты', 'Кабинет', '№']
+TABLE_FORMATS = ('csv', 'parquet')
+# Keys of the '<key>_name' / '<key>_buffer' pairs in a generate_outputs result.
+OUTPUT_FILES = ('ready', 'reference', 'unassigned', 'table', 'bundle')
+
+
+def validate_rooms(rooms_df: pd.DataFrame):
     if 'Кабинет' not in rooms_df.columns:
         raise ValueError("В файле кабинетов не найден столбец 'Кабинет'.")
+    for column in (ROOM_CAPACITY_COLUMN, ROOM_CLASS_CAP_COLUMN):
+        if column not in rooms_df.columns:
+            continue
+        text = _clean_text(rooms_df[column])
+        values = pd.to_numeric(text, errors='coerce')
+        invalid = text.notna() & ~((values >= 1) & (values % 1 == 0))
+        if invalid.any():
+            rooms = ', '.join(_clean_text(rooms_df.loc[invalid, 'Кабинет']).fillna('?'))
+            raise ValueError(f"В столбце '{column}' должны быть целые числа больше нуля (кабинеты: {rooms}).")
+
 
+def validate_students(students_df: pd.DataFrame):
     missing = REQUIRED_STUDENT_COLUMNS - set(students_df.columns)
     if missing:
         missing_cols = ', '.join(sorted(missing))
         raise ValueError(f"В файле учеников отсутствуют столбцы: {missing_cols}")
 
 
-def build_assignments(students_df, available_rooms, max_per_room=23, max_per_class_in_room=3, attempts=400):
-    class_sizes = students_df['Сыныбы'].value_counts().to_dict()
-    best_assignments = None
-    best_unassigned = None
+def validate_inputs(rooms_df: pd.DataFrame, students_df: pd.DataFrame):
+    validate_rooms(rooms_df)
+    validate_students(students_df)
+
+
+def _clean_text(values: pd.Series) -> pd.Series:
+    # Numeric cells (ИИН, room numbers) may arrive as floats, e.g. '123456789012.0';
+    # keep just the digits and leave blank cells empty instead of 'nan'.
+    text = values.astype('string').str.strip().str.replace(r'\.0$', '', regex=True)
+    return text.astype(object).where(text.notna() & (text != ''), None)
+
+
+def _room_capacities(rooms_df, max_per_room, max_per_class_in_room):
+    # Rooms with a blank name are skipped, as before; the caps stay aligned with the names.
+    names = _clean_text(rooms_df['Кабинет'])
+    present = names.notna().to_numpy()
+    caps = []
+    for column, default in ((ROOM_CAPACITY_COLUMN, max_per_room), (ROOM_CLASS_CAP_COLUMN, max_per_class_in_room)):
+        values = np.full(int(present.sum()), np.nan)
+        if column in rooms_df.columns:
+            values = pd.to_numeric(_clean_text(rooms_df[column]), errors='coerce').to_numpy(dtype=float)[present]
+        caps.append(np.where(np.isnan(values), default, values).astype(np.int64))
+    return names[present].tolist(), caps[0], caps[1]
+
+
+def _capacity_arrays(n_rooms, max_per_room, max_per_class_in_room):
+    # Every engine works on per-room arrays; a single number means the same cap for all rooms.
+    room_caps = np.broadcast_to(np.asarray(max_per_room, dtype=np.int64), (n_rooms,)).copy()
+    class_caps = np.broadcast_to(np.asarray(max_per_class_in_room, dtype=np.int64), (n_rooms,)).copy()
+    return room_caps, class_caps
+
+
+def _encode_students(students_df):
+    class_codes, class_labels = pd.factorize(students_df['Сыныбы'], use_na_sentinel=False)
+    class_sizes = np.bincount(class_codes, minlength=len(class_labels))
+    by_class = np.argsort(class_codes, kind='stable')
+    # np.split of an empty roster would still return one (empty) class.
+    class_members = np.split(by_class, np.cumsum(class_sizes)[:-1]) if len(class_sizes) else []
+    return class_sizes, class_members
+
+
+def _place_class(members, room_sizes, class_counts, placement, room_caps, class_caps, rng):
+    # Rooms holding `level` students of this class and still below both of their caps are
+    # filled smallest-first (random among equal sizes); a chosen room leaves the level, so one
+    # vectorized pass per level gives the same result as placing students one by one.
+    placed = 0
+    for level in range(int(class_caps.max(initial=0))):
+        if placed == len(members):
+            break
+        eligible = np.flatnonzero((class_counts == level) & (room_sizes < room_caps) & (class_caps > level))
+        if not len(eligible):
+            # A repair starts from existing counts, so a level can be empty below open ones.
+            continue
+        order = eligible[np.lexsort((rng.random(len(eligible)), room_sizes[eligible]))]
+        chosen = order[:len(members) - placed]
+        placement[members[placed:placed + len(chosen)]] = chosen
+        room_sizes[chosen] += 1
+        class_counts[chosen] += 1
+        placed += len(chosen)
+
+
+class _RoomQueue:
+    """Rooms with free seats ordered by size, plus a histogram of their sizes.
+
+    The histogram gives every size bucket's bounds in the queue, so taking the k smallest
+    rooms and putting them back costs O(k + sizes) index work instead of a sort of all rooms.
+    """
+
+    def __init__(self, room_caps, class_caps):
+        self.rooms = np.flatnonzero((room_caps > 0) & (class_caps > 0))
+        self.counts = np.zeros(int(room_caps.max(initial=0)) + 1, dtype=np.int64)
+        self.counts[0] = len(self.rooms)
+
+    def take(self, k, rng):
+        """Remove and return the k smallest rooms, random among rooms of equal size."""
+        k = min(k, len(self.rooms))
+        ends = np.cumsum(self.counts)
+        size = int(np.searchsorted(ends, k))
+        start = int(ends[size] - self.counts[size])
+        extra = k - start
+        if 0 < extra < self.counts[size]:
+            # Only part of this bucket fits: swap a random sample of it to the bucket's front.
+            picked = start + rng.choice(int(self.counts[size]), extra, replace=False)
+            in_front = np.zeros(extra, dtype=bool)
+            in_front[picked[picked < k] - start] = True
+            outside = picked[picked >= k]
+            vacant = start + np.flatnonzero(~in_front)
+            self.rooms[outside], self.rooms[vacant] = self.rooms[vacant], self.rooms[outside]
+        taken = self.rooms[:k].copy()
+        self.rooms = self.rooms[k:]
+        self.counts[:size] = 0
+        self.counts[size] -= extra
+        return taken
+
+    def put(self, rooms, sizes, room_caps):
+        """Re-insert rooms at their new sizes; rooms that reached their cap are dropped."""
+        open_rooms = sizes < room_caps[rooms]
+        rooms, sizes = rooms[open_rooms], sizes[open_rooms]
+        order = np.argsort(sizes, kind='stable')
+        rooms, sizes = rooms[order], sizes[order]
+        # Each room lands after the queued rooms of its size (np.insert without its overhead).
+        merged = np.empty(len(self.rooms) + len(rooms), dtype=np.int64)
+        slots = np.cumsum(self.counts)[sizes] + np.arange(len(rooms))
+        queued = np.ones(len(merged), dtype=bool)
+        queued[slots] = False
+        merged[slots] = rooms
+        merged[queued] = self.rooms
+        self.rooms = merged
+        self.counts += np.bincount(sizes, minlength=len(self.counts))
+
+
+def _place_class_from_queue(members, room_sizes, queue, placement, room_caps, class_caps, rng):
+    # Same levels as _place_class for a class with no students placed yet: level 0 is the
+    # smallest rooms of the queue, every later level can only reuse rooms of the level
+    # before, so no step looks at rooms the class does not touch.
+    touched = queue.take(len(members), rng)
+    chosen = touched
+    placed = 0
+    level = 0
+    while len(chosen):
+        placement[members[placed:placed + len(chosen)]] = chosen
+        room_sizes[chosen] += 1
+        placed += len(chosen)
+        level += 1
+        if placed == len(members):
+            break
+        eligible = chosen[(room_sizes[chosen] < room_caps[chosen]) & (class_caps[chosen] > level)]
+        order = eligible[np.lexsort((rng.random(len(eligible)), room_sizes[eligible]))]
+        chosen = order[:len(members) - placed]
+    queue.put(touched, room_sizes[touched], room_caps)
+
+
+def _run_attempt(class_sizes, class_members, n_rooms, room_caps, class_caps, rng):
+    class_order = np.lexsort((rng.random(len(class_sizes)), -class_sizes))
+    placement = np.full(int(class_sizes.sum()), -1, dtype=np.int64)
+    room_sizes = np.zeros(n_rooms, dtype=np.int64)
+    queue = _RoomQueue(room_caps, class_caps)
+
+    for cls in class_order:
+        _place_class_from_queue(
+            rng.permutation(class_members[cls]),
+            room_sizes,
+            queue,
+            placement,
+            room_caps,
+            class_caps,
+            rng,
+        )
+
+    return placement
+
+
+def _find_augmenting_path(counts, leftover, spare, class_caps):
+    # Layered BFS over the residual class -> room network: a class reaches a room while it
+    # holds fewer than the room's class cap there, a room reaches back to every
+    # class it already holds. Returns (class, room) edges with +1 for forward, -1 for back.
+    n_classes, n_rooms = counts.shape
+    class_parent = np.full(n_classes, -2, dtype=np.int64)
+    room_parent = np.full(n_rooms, -1, dtype=np.int64)
+    frontier = np.flatnonzero(leftover > 0)
+    class_parent[frontier] = -1
+
+    while frontier.size:
+        forward = (counts[frontier] < class_caps) & (room_parent < 0)
+        new_rooms = np.flatnonzero(forward.any(axis=0))
+        if not new_rooms.size:
+            return None
+        room_parent[new_rooms] = frontier[forward[:, new_rooms].argmax(axis=0)]
+
+        open_rooms = new_rooms[spare[new_rooms] > 0]
+        if open_rooms.size:
+            path = []
+            room = open_rooms[0]
+            while True:
+                cls = room_parent[room]
+                path.append((cls, room, 1))
+                if class_parent[cls] == -1:
+                    return path
+                room = class_parent[cls]
+                path.append((cls, room, -1))
+
+        backward = (counts[:, new_rooms] > 0) & (class_parent == -2)[:, None]
+        frontier = np.flatnonzero(backward.any(axis=1))
+        class_parent[frontier] = new_rooms[backward[frontier].argmax(axis=1)]
+
+    return None
+
+
+def _solve_flow(class_sizes, class_members, n_rooms, room_caps, class_caps, rng):
+    # One greedy pass gives a balanced feasible flow; augmenting paths then raise it to the
+    # maximum, so whatever is left unassigned afterwards is a proven minimum.
+    placement = _run_attempt(class_sizes, class_members, n_rooms, room_caps, class_caps, rng)
+    counts = np.zeros((len(class_sizes), n_rooms), dtype=np.int64)
+    for cls, members in enumerate(class_members):
+        rooms = placement[members]
+        counts[cls] = np.bincount(rooms[rooms >= 0], minlength=n_rooms)
+    _augment_counts(counts, class_sizes, room_caps, class_caps)
+
+    # Shuffle within each class, as the greedy engine does, so roster order does not decide
+    # who shares a room or who is left over.
+    placement = np.full(len(placement), -1, dtype=np.int64)
+    for cls, members in enumerate(class_members):
+        rooms = np.repeat(np.arange(n_rooms), counts[cls])
+        placement[rng.permutation(members)[:len(rooms)]] = rooms
+
+    return placement
+
+
+def _augment_counts(counts, class_sizes, room_caps, class_caps):
+    # Raises a feasible class x room count matrix to the maximum flow in place. Paths are
+    # shortest in the residual network, so each unit moves as few seated students as possible.
+    while True:
+        leftover = class_sizes - counts.sum(axis=1)
+        spare = room_caps - counts.sum(axis=0)
+        path = _find_augmenting_path(counts, leftover, spare, class_caps)
+        if path is None:
+            break
+
+        first_cls = path[-1][0]
+        last_room = path[0][1]
+        amount = min(leftover[first_cls], spare[last_room])
+        for cls, room, direction in path:
+            residual = class_caps[room] - counts[cls, room] if direction > 0 else counts[cls, room]
+            amount = min(amount, residual)
+        for cls, room, direction in path:
+            counts[cls, room] += direction * amount
+
 
-    for _ in range(attempts):
-        class_order = sorted(class_sizes.keys(), key=lambda cls: (-class_sizes[cls], random.random()))
-        ordered_students = []
+def _max_flow_value(class_sizes, room_caps, room_class_caps):
+    # The max flow source -> class -> room -> sink equals the minimum cut. If s classes stay
+    # on the source side, each room costs min(its capacity, s * its class cap) and the other
+    # classes cost their size, so the cheapest s classes to keep are the largest ones and a
+    # single vectorized pass over s = 0..C gives the exact value.
+    # Returns (max flow, s) where the s largest classes are the ones the rooms cannot absorb.
+    sizes = np.sort(np.asarray(class_sizes, dtype=np.int64))[::-1]
+    outside = np.concatenate((np.cumsum(sizes[::-1])[::-1], [0]))
+    kept = np.arange(len(sizes) + 1)
+    room_side = np.minimum(room_caps[None, :], kept[:, None] * room_class_caps[None, :]).sum(axis=1)
+    cut = outside + room_side
+    best = int(np.argmin(cut))
+    return int(cut[best]), best
 
-        for cls in class_order:
-            cls_students = students_df[students_df['Сыныбы'] == cls].sample(frac=1).to_dict('records')
-            ordered_students.extend(cls_students)
 
-        room_assignments = {room: [] for room in available_rooms}
-        room_sizes = {room: 0 for room in available_rooms}
-        room_class_counts = {room: defaultdict(int) for room in available_rooms}
-        unassigned_students = []
+def preflight_check(students_df, available_rooms, max_per_room=23, max_per_class_in_room=3) -> dict:
+    """Exact lower bound on unassigned students and the classes that cause it, before any search.
+
+    The caps are single numbers or per-room sequences aligned with `available_rooms`.
+    'bottleneck_classes' lists the classes larger than all the seats rooms allow one class;
+    'class_cap_shortfall' is the part of the bound that neither those classes nor the total
+    capacity explain, caused by the per-class room limits acting together.
+    """
+    class_sizes = students_df['Сыныбы'].value_counts(dropna=False)
+    room_caps, room_class_caps = _capacity_arrays(len(available_rooms), max_per_room, max_per_class_in_room)
+    max_flow, n_limited = _max_flow_value(class_sizes.to_numpy(), room_caps, room_class_caps)
+    lower_bound = len(students_df) - max_flow
+
+    class_slots = int(np.minimum(room_caps, room_class_caps).sum())
+    capacity_shortfall = max(0, len(students_df) - int(room_caps.sum()))
+    bottlenecks = []
+    if lower_bound and n_limited < len(class_sizes):
+        # With per-room caps the classes of the min cut need not each exceed their seats.
+        bottlenecks = [
+            {'class': label, 'size': int(size), 'room_slots': class_slots}
+            for label, size in class_sizes.iloc[:n_limited].items()
+            if size > class_slots
+        ]
+    # Each explanation alone is a valid bound, so only what exceeds the larger one is left.
+    explained = max(capacity_shortfall, sum(item['size'] - class_slots for item in bottlenecks))
+    return {
+        'lower_bound': int(lower_bound),
+        'capacity': int(room_caps.sum()),
+        'capacity_shortfall': capacity_shortfall,
+        'bottleneck_classes': bottlenecks,
+        'class_cap_shortfall': max(0, int(lower_bound) - explained),
+    }
 
-        for student in ordered_students:
-            student_class = student['Сыныбы']
-            candidate_rooms = [
-                room for room in available_rooms
-                if room_sizes[room] < max_per_room and room_class_counts[room][student_class] < max_per_class_in_room
-            ]
 
-            if not candidate_rooms:
-                unassigned_students.append(student)
+def _best_swap(counts, class_caps, deadline):
+    # A swap keeps room sizes, so only the class term changes. Moving one student of class c
+    # from a to b and one of class d from b to a changes sum(counts**2) by twice
+    # (C[c,b] - C[c,a] + 1) + (C[d,a] - C[d,b] + 1). One of the two halves must then be
+    # negative on its own, i.e. c sits in a at least twice more often than in some room it
+    # may still enter, so only those (c, a) pairs are tried.
+    # Masked entries get a gain low enough that their delta can never be negative.
+    blocked = -3 * int(class_caps.max())
+    lightest = np.where(counts < class_caps, counts, class_caps).min(axis=1)
+    classes, rooms = np.nonzero(counts - lightest[:, None] >= 2)
+    for idx in np.argsort(-counts[classes, rooms], kind='stable'):
+        if time.perf_counter() >= deadline:
+            break
+        cls, room = classes[idx], rooms[idx]
+        # For each target room b, the class d whose trip back to `room` gains the most.
+        back = counts - counts[:, room][:, None]
+        back[(counts == 0) | (counts[:, room] >= class_caps[room])[:, None]] = blocked
+        back[cls] = blocked
+        best_class = back.argmax(axis=0)
+        delta = counts[cls] - counts[cls, room] + 2 - back[best_class, np.arange(counts.shape[1])]
+        delta[counts[cls] >= class_caps] = 0
+        target = int(delta.argmin())
+        if delta[target] < 0:
+            return cls, room, best_class[target], target
+    return None
+
+
+def _refine_counts(counts, room_caps, class_caps, deadline):
+    # Local search on sum(room_size**2) + sum(class_count**2): the first term evens out room
+    # sizes, the second spreads each class over more rooms. Moving one student of class c
+    # from room a to b changes it by 2 * ((s_b + C[c,b]) - (s_a + C[c,a]) + 2), so each class's
+    # best move comes from one masked max/min over the (class, room) table. Moves that touch
+    # different rooms do not change each other's delta, so a round applies all of them
+    # best-first; swaps are only searched once no move helps.
+    # Loads never exceed the largest room cap plus the largest class cap, so these masks
+    # keep delta > 0.
+    sizes = counts.sum(axis=0)
+    full = int(room_caps.max() + class_caps.max()) + 1
+    rows = np.arange(len(counts))
+    moves = swaps = 0
+    while time.perf_counter() < deadline:
+        load = sizes[None, :] + counts
+        source_load = np.where(counts > 0, load, -1)
+        target_load = np.where((counts < class_caps) & (sizes < room_caps)[None, :], load, full)
+        sources = source_load.argmax(axis=1)
+        targets = target_load.argmin(axis=1)
+        delta = target_load[rows, targets] - source_load[rows, sources] + 2
+
+        touched = np.zeros(len(sizes), dtype=bool)
+        for cls in np.argsort(delta, kind='stable'):
+            if delta[cls] >= 0:
+                break
+            source, target = sources[cls], targets[cls]
+            if touched[source] or touched[target]:
                 continue
+            touched[source] = touched[target] = True
+            counts[cls, source] -= 1
+            counts[cls, target] += 1
+            sizes[source] -= 1
+            sizes[target] += 1
+            moves += 1
+        if touched.any():
+            continue
+
+        swap = _best_swap(counts, class_caps, deadline)
+        if swap is None:
+            break
+        cls, room, other, target = swap
+        counts[cls, room] -= 1
+        counts[cls, target] += 1
+        counts[other, target] -= 1
+        counts[other, room] += 1
+        swaps += 1
+    return moves, swaps
+
+
+def refine_placement(students_df, n_rooms, placement, max_per_room=23, max_per_class_in_room=3, seconds=1.0,
+                     tracer=None):
+    """Even out room sizes and class mixes of a placement by moving and swapping students.
+
+    Unassigned students stay unassigned and the caps are kept. The search stops at a local
+    optimum, usually well inside `seconds`; a run cut off by the budget is the only case
+    where the result depends on machine speed. Returns a new placement array.
+    """
+    deadline = time.perf_counter() + seconds
+    room_caps, class_caps = _capacity_arrays(n_rooms, max_per_room, max_per_class_in_room)
+    class_sizes, class_members = _encode_students(students_df)
+    counts = np.zeros((len(class_sizes), n_rooms), dtype=np.int64)
+    for cls, members in enumerate(class_members):
+        rooms = placement[members]
+        counts[cls] = np.bincount(rooms[rooms >= 0], minlength=n_rooms)
+    before = int((counts.sum(axis=0) ** 2).sum() + (counts ** 2).sum())
+
+    moves, swaps = _refine_counts(counts, room_caps, class_caps, deadline)
+
+    # Students whose (class, room) count did not drop keep their seat; the surplus of the rooms
+    # a class left fills the rooms it gained.
+    placement = placement.copy()
+    for cls, members in enumerate(class_members):
+        rooms = placement[members]
+        seated = members[rooms >= 0]
+        old = np.bincount(rooms[rooms >= 0], minlength=n_rooms)
+        if np.array_equal(old, counts[cls]):
+            continue
+        seated = seated[np.argsort(placement[seated], kind='stable')]
+        rank = np.arange(len(seated)) - np.repeat(np.cumsum(old) - old, old)
+        released = seated[rank >= counts[cls][placement[seated]]]
+        placement[released] = np.repeat(np.arange(n_rooms), np.maximum(counts[cls] - old, 0))
+
+    if tracer is not None:
+        after = int((counts.sum(axis=0) ** 2).sum() + (counts ** 2).sum())
+        tracer.info.update(refine_moves=moves, refine_swaps=swaps, refine_gain=before - after)
+    return placement
+
+
+_stop_after = None
+_shared_progress = None
+
+
+def _attempt_rng(entropy, attempt):
+    # Attempt N always draws from the same stream for a given master seed, whichever
+    # worker runs it, so the result does not depend on the worker count.
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(attempt,)))
 
-            min_class_count = min(room_class_counts[room][student_class] for room in candidate_rooms)
-            candidate_rooms = [room for room in candidate_rooms if room_class_counts[room][student_class] == min_class_count]
 
-            min_room_size = min(room_sizes[room] for room in candidate_rooms)
-            candidate_rooms = [room for room in candidate_rooms if room_sizes[room] == min_room_size]
+def _init_search_worker(stop_after, attempts_done, shared_best):
+    global _stop_after, _shared_progress
+    _stop_after = stop_after
+    _shared_progress = (attempts_done, shared_best)
 
-            chosen_room = random.choice(candidate_rooms)
-            room_assignments[chosen_room].append(student)
-            room_sizes[chosen_room] += 1
-            room_class_counts[chosen_room][student_class] += 1
 
-        if best_unassigned is None or len(unassigned_students) < len(best_unassigned):
-            best_assignments = room_assignments
-            best_unassigned = unassigned_students
+def _report_shared_progress(attempt, best_unassigned):
+    attempts_done, shared_best = _shared_progress
+    with attempts_done.get_lock():
+        attempts_done.value += 1
+    with shared_best.get_lock():
+        if shared_best.value < 0 or best_unassigned < shared_best.value:
+            shared_best.value = best_unassigned
 
-        if not unassigned_students:
+
+def _search_attempts(
+    class_sizes,
+    class_members,
+    n_rooms,
+    room_caps,
+    class_caps,
+    attempt_numbers,
+    entropy,
+    target=0,
+    stop_after=None,
+    progress=None,
+):
+    best_placement = None
+    best_unassigned = None
+    best_attempt = None
+    attempts_used = 0
+
+    for attempt in attempt_numbers:
+        if stop_after is not None and attempt > stop_after.value:
             break
+        attempts_used += 1
 
-    return best_assignments, best_unassigned
+        rng = _attempt_rng(entropy, attempt)
+        placement = _run_attempt(class_sizes, class_members, n_rooms, room_caps, class_caps, rng)
+        unassigned = int(np.count_nonzero(placement < 0))
 
+        if best_unassigned is None or unassigned < best_unassigned:
+            best_placement = placement
+            best_unassigned = unassigned
+            best_attempt = attempt
+
+        if progress is not None:
+            progress(attempt, best_unassigned)
+
+        if unassigned <= target:
+            if stop_after is not None:
+                with stop_after.get_lock():
+                    stop_after.value = min(stop_after.value, attempt)
+            break
+
+    return best_placement, best_unassigned, attempts_used, best_attempt
+
+
+def _search_worker(*args):
+    return _search_attempts(*args, stop_after=_stop_after, progress=_report_shared_progress)
 
-def _format_workbook(workbook_path: str, title_last_col: str = 'E'):
-    wb = load_workbook(workbook_path)
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin'),
-    )
 
-    for sheet in wb.sheetnames:
-        ws = wb[sheet]
-        expected_max_col = column_index_from_string(title_last_col)
+def _search_parallel(search_args, attempts, workers, entropy, target=0, progress=None):
+    # Worker i runs attempts i+1, i+1+workers, ... Once an attempt reaches the target (the
+    # proven lower bound) every later-numbered attempt is skipped, but earlier ones still
+    # run, so the winner is the lowest-numbered best attempt exactly as in a serial search.
+    # spawn: the app calls this from a thread of the Streamlit server, which is not safe to fork.
+    context = mp.get_context('spawn')
+    stop_after = context.Value('q', attempts)
+    attempts_done = context.Value('q', 0)
+    shared_best = context.Value('q', -1)
 
-        # Remove accidental empty columns to the right (e.g. empty E in reference file)
-        if ws.max_column > expected_max_col:
-            ws.delete_cols(expected_max_col + 1, ws.max_column - expected_max_col)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_search_worker,
+        initargs=(stop_after, attempts_done, shared_best),
+    ) as pool:
+        futures = [
+            pool.submit(_search_worker, *search_args, range(index + 1, attempts + 1, workers), entropy, target)
+            for index in range(workers)
+        ]
+        try:
+            pending = futures
+            while pending:
+                _, pending = wait(pending, timeout=0.25)
+                if progress is not None and shared_best.value >= 0:
+                    progress(attempts_done.value, shared_best.value)
+        except BaseException:
+            stop_after.value = 0
+            raise
+        results = [future.result() for future in futures]
 
-        ws.merge_cells(f'A1:{title_last_col}1')
-        ws['A1'] = f'Кабинет: {sheet}'
-        ws['A1'].font = Font(name='Times New Roman', size=28, bold=True)
-        ws['A1'].alignment = Alignment(horizontal='center', vertical='center')
+    best = min((result for result in results if result[0] is not None), key=lambda result: (result[1], result[3]))
+    return best[0], best[1], sum(result[2] for result in results), best[3]
 
-        for col_idx in range(1, expected_max_col + 1):
-            max_length = 0
-            col_letter = get_column_letter(col_idx)
-            for row_idx in range(2, ws.max_row + 1):
-                cell = ws.cell(row=row_idx, column=col_idx)
-                cell.border = thin_border
-                cell.font = Font(name='Times New Roman', size=14)
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-                if cell.value is not None and str(cell.value) != '':
-                    max_length = max(max_length, len(str(cell.value)))
-            ws.column_dimensions[col_letter].width = max_length + 5
 
-    wb.save(workbook_path)
+def build_placement(
+    students_df,
+    available_rooms,
+    max_per_room=23,
+    max_per_class_in_room=3,
+    attempts=400,
+    workers=1,
+    seed=None,
+    solver='greedy',
+    progress=None,
+    tracer=None,
+    lower_bound=None,
+):
+    """Place students into rooms; returns the room index of every students_df row (-1 if unassigned).
+
+    `max_per_room` and `max_per_class_in_room` are single numbers or per-room sequences
+    aligned with `available_rooms`; the same holds for the other engines below.
+    `progress`, if given, is called as progress(attempt, best_unassigned) while the search
+    runs; an exception raised from it aborts the search. A `tracer` receives the number of
+    attempts used and the attempt that produced the returned placement. The same `seed`
+    gives the same placement for any number of workers. `lower_bound` is preflight_check's
+    value for the same inputs, if the caller already has it; otherwise it is computed here.
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"Неизвестный режим распределения: {solver}")
+
+    class_sizes, class_members = _encode_students(students_df)
+    n_rooms = len(available_rooms)
+    room_caps, class_caps = _capacity_arrays(n_rooms, max_per_room, max_per_class_in_room)
+    # No placement can beat the max-flow bound, so the search stops as soon as it hits it.
+    if lower_bound is None:
+        max_flow, _ = _max_flow_value(class_sizes, room_caps, class_caps)
+        lower_bound = len(students_df) - max_flow
+    workers = max(1, min(workers, attempts))
+    entropy = np.random.SeedSequence(seed).entropy
+    search_args = (class_sizes, class_members, n_rooms, room_caps, class_caps)
+
+    if solver == 'flow':
+        best_placement = _solve_flow(*search_args, _attempt_rng(entropy, 0))
+        attempts_used = best_attempt = 1
+        if progress is not None:
+            progress(1, int(np.count_nonzero(best_placement < 0)))
+    elif workers == 1:
+        best_placement, _, attempts_used, best_attempt = _search_attempts(
+            *search_args, range(1, attempts + 1), entropy, lower_bound, progress=progress
+        )
+    else:
+        best_placement, _, attempts_used, best_attempt = _search_parallel(
+            search_args, attempts, workers, entropy, lower_bound, progress=progress
+        )
+
+    if tracer is not None:
+        tracer.info.update(
+            solver=solver,
+            workers=workers,
+            attempts_used=attempts_used,
+            best_attempt=best_attempt,
+            lower_bound=lower_bound,
+        )
+
+    return best_placement
 
 
-def _build_sheet_df(students):
-    df_room = pd.DataFrame(students)
-    if df_room.empty:
-        df_room = pd.DataFrame(columns=['ИИН', 'Сыныбы', 'Тегі', 'Аты'])
-    if 'Сыныбы' in df_room.columns:
-        df_room = df_room.sort_values(by='Сыныбы').reset_index(drop=True)
-    df_room.insert(0, '№', range(1, len(df_room) + 1))
-    return df_room
+def build_assignments(students_df, available_rooms, *args, **kwargs):
+    """Like build_placement, but returns ({room: [student records]}, [unassigned records])."""
+    placement = build_placement(students_df, available_rooms, *args, **kwargs)
+    return _placement_to_records(students_df, available_rooms, placement)
+
+
+def _placement_to_records(students_df, available_rooms, placement):
+    records = students_df.to_dict('records')
+    room_assignments = {room: [] for room in available_rooms}
+    unassigned_students = []
+    for row, room_idx in enumerate(placement.tolist()):
+        if room_idx < 0:
+            unassigned_students.append(records[row])
+        else:
+            room_assignments[available_rooms[room_idx]].append(records[row])
+
+    return room_assignments, unassigned_students
+
+
+def reallocate_placement(
+    students_df,
+    available_rooms,
+    previous_df,
+    max_per_room=23,
+    max_per_class_in_room=3,
+    seed=None,
+    progress=None,
+    tracer=None,
+):
+    """Repair a previous allocation after students or rooms were added or removed.
+
+    `previous_df` maps ИИН to Кабинет (see read_previous_assignment). Students keep their
+    previous room while it still exists and the caps allow; only newcomers, students of
+    removed rooms and those over a (possibly lowered) cap are placed again. Returns
+    (placement, churn) where placement is as in build_placement and churn counts kept,
+    moved and new.
+    """
+    rng = np.random.default_rng(seed)
+    class_sizes, class_members = _encode_students(students_df)
+    class_codes = np.empty(len(students_df), dtype=np.int64)
+    for code, members in enumerate(class_members):
+        class_codes[members] = code
+    n_rooms = len(available_rooms)
+    room_caps, class_caps = _capacity_arrays(n_rooms, max_per_room, max_per_class_in_room)
+
+    previous_rooms = dict(zip(_clean_text(previous_df['ИИН']), _clean_text(previous_df['Кабинет'])))
+    previous_rooms.pop(None, None)
+    room_index = {room: idx for idx, room in enumerate(available_rooms)}
+    previous_names = [previous_rooms.get(iin) for iin in _clean_text(students_df['ИИН'])]
+    placement = np.array([room_index.get(name, -1) for name in previous_names], dtype=np.int64)
+
+    # Caps may have been lowered since the previous run: release a random surplus.
+    kept = np.flatnonzero(placement >= 0)
+    kept = kept[rng.permutation(len(kept))]
+    by_class = pd.DataFrame({'room': placement[kept], 'cls': class_codes[kept]})
+    within = by_class.groupby(['room', 'cls']).cumcount().to_numpy() < class_caps[placement[kept]]
+    placement[kept[~within]] = -1
+    kept = kept[within]
+    within = pd.Series(placement[kept]).groupby(placement[kept]).cumcount().to_numpy() < room_caps[placement[kept]]
+    placement[kept[~within]] = -1
+    kept = kept[within]
+
+    room_sizes = np.bincount(placement[kept], minlength=n_rooms).astype(np.int64)
+    class_counts = np.bincount(
+        class_codes[kept] * n_rooms + placement[kept], minlength=len(class_sizes) * n_rooms
+    ).reshape(len(class_sizes), n_rooms).astype(np.int64)
+
+    pending = np.flatnonzero(placement < 0)
+    pending_sizes = np.bincount(class_codes[pending], minlength=len(class_sizes))
+    for cls in np.lexsort((rng.random(len(class_sizes)), -pending_sizes)):
+        if not pending_sizes[cls]:
+            break
+        members = pending[class_codes[pending] == cls]
+        _place_class(
+            rng.permutation(members),
+            room_sizes,
+            class_counts[cls],
+            placement,
+            room_caps,
+            class_caps,
+            rng,
+        )
+
+    # Greedy placement around fixed students can strand some that a few moves would seat;
+    # augmenting paths then reach the max-flow bound. Students placed in this repair are
+    # moved before kept ones.
+    before = class_counts.copy()
+    _augment_counts(class_counts, class_sizes, room_caps, class_caps)
+    is_kept = np.zeros(len(placement), dtype=bool)
+    is_kept[kept] = True
+    for cls in np.flatnonzero((class_counts != before).any(axis=1)):
+        members = class_members[cls]
+        delta = class_counts[cls] - before[cls]
+        for room in np.flatnonzero(delta < 0):
+            seated = members[placement[members] == room]
+            seated = seated[np.lexsort((rng.random(len(seated)), is_kept[seated]))]
+            placement[seated[:-delta[room]]] = -1
+        waiting = rng.permutation(members[placement[members] < 0])
+        rooms = np.repeat(np.arange(n_rooms), np.maximum(delta, 0))
+        placement[waiting[:len(rooms)]] = rooms
+
+    had_room = np.array([name is not None for name in previous_names], dtype=bool)
+    final_names = np.array([available_rooms[idx] if idx >= 0 else None for idx in placement.tolist()], dtype=object)
+    stayed = had_room & (final_names == np.array(previous_names, dtype=object))
+    churn = {
+        'kept': int(stayed.sum()),
+        'moved': int((had_room & ~stayed).sum()),
+        'new': int((~had_room).sum()),
+    }
+    if tracer is not None:
+        tracer.info.update(solver='incremental', **churn)
+    if progress is not None:
+        progress(1, int(np.count_nonzero(placement < 0)))
+
+    return placement, churn
+
+
+def _add_named_styles(wb):
+    thin = Side(style='thin')
+    centered = Alignment(horizontal='center', vertical='center')
+    wb.add_named_style(NamedStyle(
+        name='room_title',
+        font=Font(name='Times New Roman', size=28, bold=True),
+        alignment=centered,
+    ))
+    wb.add_named_style(NamedStyle(
+        name='room_cell',
+        font=Font(name='Times New Roman', size=14),
+        alignment=centered,
+        border=Border(left=thin, right=thin, top=thin, bottom=thin),
+    ))
+
+
+_STABLE_TIMESTAMP = datetime(1980, 1, 1)
+
+
+class _StableZipFile(zipfile.ZipFile):
+    # Every member gets the same timestamp, so equal workbooks are equal byte for byte.
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+        if not isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+            zinfo_or_arcname = self._stable_info(zinfo_or_arcname)
+        super().writestr(zinfo_or_arcname, data, compress_type, compresslevel)
+
+    def write(self, filename, arcname=None, compress_type=None, compresslevel=None):
+        # Write-only sheets arrive as temporary files; copy them without their mtime.
+        with open(filename, 'rb') as source, self.open(self._stable_info(arcname or filename), 'w') as member:
+            shutil.copyfileobj(source, member)
+
+    def _stable_info(self, arcname):
+        info = zipfile.ZipInfo(arcname, date_time=_STABLE_TIMESTAMP.timetuple()[:6])
+        info.external_attr = 0o600 << 16
+        info.compress_type = self.compression
+        return info
+
+
+def _save_workbook(wb, target):
+    # openpyxl stamps the save time into docProps/core.xml and every zip entry; pin both.
+    wb.properties.created = wb.properties.modified = _STABLE_TIMESTAMP
+    with _StableZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        ExcelWriter(wb, archive).save()
+
+
+def _styled_cell(ws, value, style):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+
+def _write_room_workbook(target, room_frames, columns):
+    # Sheets are streamed already styled: a merged 'Кабинет: ...' title row, then the header
+    # and data rows with column widths taken from the longest value (as Excel autofit would).
+    wb = Workbook(write_only=True)
+    _add_named_styles(wb)
+    last_col = get_column_letter(len(columns))
+
+    for room, df_room in room_frames:
+        rows = df_room[columns].values.tolist()
+
+        ws = wb.create_sheet(title=room)
+        for col_idx, name in enumerate(columns):
+            lengths = [len(str(row[col_idx])) for row in rows if row[col_idx] is not None]
+            ws.column_dimensions[get_column_letter(col_idx + 1)].width = max([len(name), *lengths]) + 5
+        ws.merged_cells.add(f'A1:{last_col}1')
+
+        ws.append([_styled_cell(ws, f'Кабинет: {room}', 'room_title')])
+        ws.append([_styled_cell(ws, name, 'room_cell') for name in columns])
+        for row in rows:
+            ws.append([_styled_cell(ws, value, 'room_cell') for value in row])
+
+    _save_workbook(wb, target)
+
+
+def _room_table(students_df, placement):
+    # One take and one sort over every placed student (room order, then class) feeds every
+    # output: the workbooks slice it per room and the flat export streams it as is.
+    placed = np.flatnonzero(placement >= 0)
+    table = students_df[STUDENT_COLUMNS].take(placed).reset_index(drop=True)
+    table['room'] = placement[placed]
+    table = table.sort_values(['room', 'Сыныбы'], kind='stable').reset_index(drop=True)
+    table.insert(0, '№', table.groupby('room').cumcount() + 1)
+    return table
+
+
+def _build_room_frames(table, available_rooms):
+    # Each room's slice already carries '№' and both column sets are projections of it.
+    bounds = np.cumsum(np.bincount(table['room'], minlength=len(available_rooms)))
+    starts = np.concatenate(([0], bounds[:-1]))
+    table = table.astype(object).where(table.notna(), None)
+    return [(room, table.iloc[start:end]) for room, start, end in zip(available_rooms, starts, bounds)]
+
+
+def _workbook_buffer(room_frames, columns):
+    buffer = BytesIO()
+    _write_room_workbook(buffer, room_frames, columns)
+    buffer.seek(0)
+    return buffer
+
+
+def _table_chunks(table, available_rooms, chunk_rows):
+    rooms = np.asarray(available_rooms, dtype=object)
+    for start in range(0, len(table), chunk_rows):
+        chunk = table.iloc[start:start + chunk_rows]
+        yield chunk.assign(Кабинет=rooms[chunk['room'].to_numpy()])[TABLE_COLUMNS]
+
+
+def _table_buffer(table, available_rooms, table_format, chunk_rows=50_000):
+    # Written chunk by chunk, so only one slice of the flat table is ever materialized.
+    buffer = BytesIO()
+    if table_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([(name, pa.string()) for name in TABLE_COLUMNS[:-1]] + [('№', pa.int64())])
+        with pq.ParquetWriter(buffer, schema) as writer:
+            for chunk in _table_chunks(table, available_rooms, chunk_rows):
+                chunk = chunk.astype({name: 'string' for name in TABLE_COLUMNS[:-1]})
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    else:
+        # utf-8-sig so that Excel opens the Cyrillic headers correctly.
+        text = TextIOWrapper(buffer, encoding='utf-8-sig', newline='')
+        text.write(','.join(TABLE_COLUMNS) + '\n')
+        for chunk in _table_chunks(table, available_rooms, chunk_rows):
+            chunk.to_csv(text, header=False, index=False, lineterminator='\n')
+        text.flush()
+        text.detach()
+    buffer.seek(0)
+    return buffer
+
+
+def _member_compression(name):
+    # xlsx and parquet are already compressed, so they are stored as is.
+    return zipfile.ZIP_DEFLATED if name.endswith('.csv') else zipfile.ZIP_STORED
+
+
+def _bundle_buffer(files):
+    buffer = BytesIO()
+    with _StableZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        for name, data in files.items():
+            bundle.writestr(name, data, compress_type=_member_compression(name))
+    buffer.seek(0)
+    return buffer
+
+
+def _unassigned_buffer(unassigned_df):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title='Sheet1')
+    bold = Font(bold=True)
+    header = []
+    for name in STUDENT_COLUMNS:
+        cell = WriteOnlyCell(ws, value=name)
+        cell.font = bold
+        header.append(cell)
+    ws.append(header)
+    for row in unassigned_df.astype(object).where(unassigned_df.notna(), None).values.tolist():
+        ws.append(row)
+
+    buffer = BytesIO()
+    _save_workbook(wb, buffer)
+    buffer.seek(0)
+    return buffer
 
 
 def generate_outputs(
@@ -125,57 +914,328 @@ def generate_outputs(
     max_per_room: int = 23,
     max_per_class_in_room: int = 3,
     attempts: int = 400,
+    workers: int = 1,
+    solver: str = 'greedy',
+    output_dir=None,
+    progress=None,
+    tracer=None,
+    previous_df=None,
+    seed=None,
+    refine_seconds: float = REFINE_SECONDS,
+    table_format=None,
+    bundle: bool = False,
 ):
-    validate_inputs(rooms_df, students_df)
-
-    available_rooms = rooms_df['Кабинет'].dropna().astype(str).tolist()
-    students_df = students_df.copy()
-    students_df['ИИН'] = students_df['ИИН'].astype(str)
-
-    room_assignments, unassigned_students = build_assignments(
-        students_df,
-        available_rooms,
-        max_per_room=max_per_room,
-        max_per_class_in_room=max_per_class_in_room,
-        attempts=attempts,
-    )
+    """Allocate students and render the output workbooks in memory.
+
+    The rooms file may carry per-room 'Орын саны' (seats) and 'Сынып шегі' (students of
+    one class) columns; blank cells use `max_per_room` / `max_per_class_in_room`.
+    With `previous_df` (ИИН -> Кабинет of an earlier run) the earlier allocation is
+    repaired incrementally instead of being recomputed. Per-stage timings and search
+    facts are returned under 'diagnostics' and logged as JSON; pass a Tracer to add
+    stages recorded before this call (e.g. ingest). With a `seed` the same inputs always
+    give byte-identical workbooks. A positive `refine_seconds` lets refine_placement
+    balance a fresh allocation (0 turns it off); incremental runs skip it so that kept
+    students are not moved. `table_format` ('csv' or 'parquet') adds a flat
+    ИИН/Сыныбы/Тегі/Аты/Кабинет/№ table under 'table', and `bundle` zips every output
+    file into 'bundle'.
+    """
+    tracer = tracer or Tracer()
+    with tracer.stage('validate'):
+        if table_format is not None and table_format not in TABLE_FORMATS:
+            raise ValueError(f"Неизвестный формат таблицы: {table_format}")
+        validate_inputs(rooms_df, students_df)
+        # From here on the caps are per-room arrays; the settings only fill blank cells.
+        available_rooms, max_per_room, max_per_class_in_room = _room_capacities(
+            rooms_df, max_per_room, max_per_class_in_room
+        )
+        students_df = students_df.copy()
+        students_df['ИИН'] = _clean_text(students_df['ИИН'])
+
+    with tracer.stage('preflight'):
+        preflight = preflight_check(students_df, available_rooms, max_per_room, max_per_class_in_room)
 
+    churn = None
+    with tracer.stage('allocate'):
+        if previous_df is not None:
+            placement, churn = reallocate_placement(
+                students_df,
+                available_rooms,
+                previous_df,
+                max_per_room=max_per_room,
+                max_per_class_in_room=max_per_class_in_room,
+                seed=seed,
+                progress=progress,
+                tracer=tracer,
+            )
+        else:
+            placement = build_placement(
+                students_df,
+                available_rooms,
+                max_per_room=max_per_room,
+                max_per_class_in_room=max_per_class_in_room,
+                attempts=attempts,
+                workers=workers,
+                seed=seed,
+                solver=solver,
+                progress=progress,
+                tracer=tracer,
+                lower_bound=preflight['lower_bound'],
+            )
+
+    if refine_seconds > 0 and previous_df is None:
+        with tracer.stage('refine'):
+            placement = refine_placement(
+                students_df,
+                len(available_rooms),
+                placement,
+                max_per_room=max_per_room,
+                max_per_class_in_room=max_per_class_in_room,
+                seconds=refine_seconds,
+                tracer=tracer,
+            )
+
+    unassigned_count = int(np.count_nonzero(placement < 0))
     timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M')
     ready_name = f'Дайын_тізім_{timestamp}.xlsx'
     reference_name = f'Анықтамаға_іліп_қою_үшін_{timestamp}.xlsx'
 
-    with pd.ExcelWriter(ready_name, engine='openpyxl') as writer:
-        for room in available_rooms:
-            df_room = _build_sheet_df(room_assignments.get(room, []))
-            df_room.to_excel(writer, sheet_name=room, startrow=1, index=False)
-
-    with pd.ExcelWriter(reference_name, engine='openpyxl') as writer:
-        for room in available_rooms:
-            df_room = _build_sheet_df(room_assignments.get(room, []))
-            # Reference file must contain exactly 4 columns: №, Сыныбы, Тегі, Аты
-            df_room = df_room[['№', 'Сыныбы', 'Тегі', 'Аты']]
-            df_room.to_excel(writer, sheet_name=room, startrow=1, index=False)
+    with tracer.stage('build_sheets'):
+        table = _room_table(students_df, placement)
+        room_frames = _build_room_frames(table, available_rooms)
 
-    _format_workbook(ready_name, title_last_col='E')
-    _format_workbook(reference_name, title_last_col='D')
+    with tracer.stage('write'):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            ready_future = pool.submit(_workbook_buffer, room_frames, READY_COLUMNS)
+            reference_future = pool.submit(_workbook_buffer, room_frames, REFERENCE_COLUMNS)
+            table_name = None
+            table_buffer = None
+            if table_format is not None:
+                table_name = f'Бөлу_кестесі_{timestamp}.{table_format}'
+                table_buffer = _table_buffer(table, available_rooms, table_format)
+            ready_buffer = ready_future.result()
+            reference_buffer = reference_future.result()
 
-    unassigned_name = None
-    if unassigned_students:
-        unassigned_name = f'Орналастыру_мүмкін_болмады_{timestamp}.xlsx'
-        unassigned_df = pd.DataFrame(unassigned_students)[['ИИН', 'Сыныбы', 'Тегі', 'Аты']]
-        unassigned_df.to_excel(unassigned_name, index=False)
+        unassigned_name = None
+        unassigned_buffer = None
+        if unassigned_count:
+            unassigned_name = f'Орналастыру_мүмкін_болмады_{timestamp}.xlsx'
+            unassigned_buffer = _unassigned_buffer(students_df[STUDENT_COLUMNS].take(np.flatnonzero(placement < 0)))
 
     result = {
         'ready_name': ready_name,
+        'ready_buffer': ready_buffer,
         'reference_name': reference_name,
+        'reference_buffer': reference_buffer,
         'unassigned_name': unassigned_name,
-        'unassigned_count': len(unassigned_students),
-        'assigned_count': len(students_df) - len(unassigned_students),
+        'unassigned_buffer': unassigned_buffer,
+        'table_name': table_name,
+        'table_buffer': table_buffer,
+        'bundle_name': None,
+        'bundle_buffer': None,
+        'unassigned_count': unassigned_count,
+        'assigned_count': len(students_df) - unassigned_count,
         'total_count': len(students_df),
+        'unassigned_is_minimum': unassigned_count == preflight['lower_bound'],
+        'preflight': preflight,
+        'churn': churn,
     }
+    if bundle:
+        with tracer.stage('bundle'):
+            result['bundle_name'] = f'Бөлу_нәтижесі_{timestamp}.zip'
+            result['bundle_buffer'] = _bundle_buffer({
+                result[f'{key}_name']: result[f'{key}_buffer'].getvalue()
+                for key in OUTPUT_FILES[:-1]
+                if result[f'{key}_buffer'] is not None
+            })
+    if output_dir is not None:
+        with tracer.stage('save'):
+            result['paths'] = save_outputs(result, output_dir)
+
+    result['diagnostics'] = tracer.to_dict()
+    tracer.emit(students=result['total_count'], rooms=len(available_rooms), unassigned=result['unassigned_count'])
     return result
 
 
+def save_outputs(result, output_dir) -> list:
+    """Write the in-memory files of a generate_outputs result into output_dir.
+
+    Existing files are never overwritten. Names only carry the minute, so when another
+    run of that minute already used one of them, every file of this result gets the
+    same _2, _3, ... suffix instead.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    files = [
+        (Path(result[f'{key}_name']), result[f'{key}_buffer'].getvalue())
+        for key in OUTPUT_FILES
+        if result[f'{key}_buffer'] is not None
+    ]
+    copy = 1
+    while True:
+        suffix = '' if copy == 1 else f'_{copy}'
+        paths = []
+        try:
+            for name, data in files:
+                path = output_dir / f'{name.stem}{suffix}{name.suffix}'
+                # 'x' creates the file atomically, so two concurrent runs cannot claim one name.
+                with open(path, 'xb') as f:
+                    paths.append(path)
+                    f.write(data)
+        except FileExistsError:
+            for path in paths:
+                path.unlink(missing_ok=True)
+            copy += 1
+            continue
+        return paths
+
+
+def _excel_engine() -> str:
+    # calamine (Rust) parses xlsx many times faster than openpyxl; fall back when it is absent.
+    return 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+
+
+def _csv_separator(data: bytes) -> str:
+    header = data.split(b'\n', 1)[0]
+    return ';' if header.count(b';') > header.count(b',') else ','
+
+
+def _source_bytes(source):
+    # Accept Streamlit uploads (anything with getvalue() and name) as well as file paths.
+    if isinstance(source, (str, Path)):
+        return Path(source).read_bytes(), str(source)
+    return source.getvalue(), getattr(source, 'name', None) or ''
+
+
+def _read_upload(uploaded_file, columns=None) -> pd.DataFrame:
+    """Parse an uploaded .xlsx, .csv or .parquet file, loading only `columns` when given."""
+    data, name = _source_bytes(uploaded_file)
+    suffix = Path(name).suffix.lower()
+    usecols = None if columns is None else (lambda name: name in columns)
+    dtype = {'ИИН': str} if columns is None else dict.fromkeys(columns, str)
+
+    if suffix == '.csv':
+        return pd.read_csv(
+            BytesIO(data), sep=_csv_separator(data), usecols=usecols, dtype=dtype, encoding='utf-8-sig'
+        )
+    if suffix == '.parquet':
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(BytesIO(data))
+        names = [name for name in parquet_file.schema_arrow.names if columns is None or name in columns]
+        return parquet_file.read(columns=names).to_pandas()
+    return pd.read_excel(BytesIO(data), engine=_excel_engine(), usecols=usecols, dtype=dtype)
+
+
+def read_rooms_upload(uploaded_file) -> pd.DataFrame:
+    rooms_df = _read_upload(uploaded_file, ROOM_COLUMNS)
+    validate_rooms(rooms_df)
+    rooms_df['Кабинет'] = _clean_text(rooms_df['Кабинет'])
+    return rooms_df
+
+
+def read_students_upload(uploaded_file) -> pd.DataFrame:
+    students_df = _read_upload(uploaded_file, REQUIRED_STUDENT_COLUMNS)
+    validate_students(students_df)
+    for column in ('ИИН', 'Сыныбы'):
+        students_df[column] = _clean_text(students_df[column])
+    return students_df
+
+
 def read_excel_from_upload(uploaded_file) -> pd.DataFrame:
-    content = BytesIO(uploaded_file.getvalue())
-    return pd.read_excel(content, engine='openpyxl', dtype={'ИИН': str})
+    return _read_upload(uploaded_file)
+
+
+def read_previous_assignment(uploaded_file) -> pd.DataFrame:
+    """Read a 'Дайын тізім' workbook back into ИИН -> Кабинет rows (one sheet per room)."""
+    sheets = pd.read_excel(
+        BytesIO(_source_bytes(uploaded_file)[0]),
+        sheet_name=None,
+        header=1,
+        engine=_excel_engine(),
+        usecols=lambda name: name == 'ИИН',
+        dtype={'ИИН': str},
+    )
+    frames = [
+        pd.DataFrame({'ИИН': sheet['ИИН'], 'Кабинет': str(room)})
+        for room, sheet in sheets.items()
+        if 'ИИН' in sheet.columns
+    ]
+    if not frames:
+        raise ValueError("В файле предыдущего распределения не найден столбец 'ИИН'.")
+    return pd.concat(frames, ignore_index=True)
+
+
+def _warm_up_batch_worker():
+    # Import the readers and writers that jobs load lazily once per worker instead of in
+    # the first job of each worker (openpyxl is already imported with this module).
+    if importlib.util.find_spec('python_calamine'):
+        import pandas.io.excel._calamine  # noqa: F401
+        import python_calamine  # noqa: F401
+    if importlib.util.find_spec('pyarrow'):
+        import pyarrow.parquet  # noqa: F401
+
+
+def _run_batch_job(job):
+    settings = {key: value for key, value in job.items() if key not in ('name', 'rooms', 'students', 'previous')}
+    rooms_df = job['rooms'] if isinstance(job['rooms'], pd.DataFrame) else read_rooms_upload(job['rooms'])
+    students_df = job['students']
+    if not isinstance(students_df, pd.DataFrame):
+        students_df = read_students_upload(students_df)
+    previous_df = job.get('previous')
+    if previous_df is not None and not isinstance(previous_df, pd.DataFrame):
+        previous_df = read_previous_assignment(previous_df)
+
+    result = generate_outputs(rooms_df, students_df, previous_df=previous_df, **settings)
+    # The batch archive already bundles everything, so a per-job bundle is left out.
+    files = {
+        result[f'{key}_name']: result[f'{key}_buffer'].getvalue()
+        for key in OUTPUT_FILES
+        if key != 'bundle' and result[f'{key}_buffer'] is not None
+    }
+    summary = {
+        key: result[key]
+        for key in ('total_count', 'assigned_count', 'unassigned_count', 'unassigned_is_minimum', 'churn')
+    }
+    summary['seconds'] = result['diagnostics']['total_seconds']
+    return files, summary
+
+
+def generate_batch_outputs(jobs, archive=None, workers=None) -> dict:
+    """Run many allocations in parallel processes and pack every output into one zip.
+
+    Each job is a dict with 'rooms' and 'students' (file paths or DataFrames), optional
+    'name' and 'previous', plus any generate_outputs setting such as 'max_per_room'.
+    The archive holds one folder per job and a summary.json; a failing job is reported
+    there instead of aborting the batch. `archive` is a path or binary file object
+    (a new BytesIO when omitted).
+    """
+    archive = BytesIO() if archive is None else archive
+    folders = []
+    for index, job in enumerate(jobs, 1):
+        folder = str(job.get('name') or f'job_{index}')
+        folders.append(folder if folder not in folders else f'{folder}_{index}')
+
+    summaries = [None] * len(jobs)
+    # spawn, as in _search_parallel: this may be called from a thread of the Streamlit server.
+    context = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_warm_up_batch_worker) as pool, \
+            zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        futures = {pool.submit(_run_batch_job, job): index for index, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            index = futures[future]
+            summary = {'name': folders[index]}
+            try:
+                files, stats = future.result()
+            except Exception as e:
+                summary['error'] = f'{type(e).__name__}: {e}'
+            else:
+                summary.update(stats)
+                for file_name, data in files.items():
+                    bundle.writestr(f'{folders[index]}/{file_name}', data, compress_type=_member_compression(file_name))
+            summaries[index] = summary
+
+        bundle.writestr('summary.json', json.dumps(summaries, ensure_ascii=False, indent=2))
+
+    if hasattr(archive, 'seek'):
+        archive.seek(0)
+    return {'archive': archive, 'jobs': summaries}
@@ -1,13 +1,34 @@
-﻿import os
+﻿import multiprocessing as mp
+import os
+import tempfile
+import time
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
-from pathlib import Path
 
 import pandas as pd
 import streamlit as st
 
-from allocator import generate_outputs, read_excel_from_upload
+from allocator import REFINE_SECONDS
+from cache import DiskResultStore, LRUCache, content_hash
+from jobs import Job, JobCancelled, submit_job
+from tracing import enable_json_log
+from worker import Upload, run_allocation
 
 
+UPLOAD_TYPES = ['xlsx', 'csv', 'parquet']
+TRACE_MEMORY = os.environ.get('ALLOCATOR_TRACE_MEMORY') == '1'
+# 'process' runs allocations in a pool of worker processes instead of UI-process threads.
+JOB_MODE = os.environ.get('ALLOCATOR_JOB_MODE', 'thread')
+JOB_WORKERS = int(os.environ.get('ALLOCATOR_JOB_WORKERS', '2'))
+# With a result directory, finished results are shared on disk by every process for RESULT_TTL seconds.
+RESULT_DIR = os.environ.get('ALLOCATOR_RESULT_DIR') or (
+    os.path.join(tempfile.gettempdir(), 'bts-allocator-results') if JOB_MODE == 'process' else None
+)
+RESULT_TTL = float(os.environ.get('ALLOCATOR_RESULT_TTL', '3600'))
+
+if os.environ.get('ALLOCATOR_TRACE_LOG') == '1':
+    enable_json_log()
+
 st.set_page_config(page_title='BTS Room Allocator', page_icon='🏫', layout='wide')
 
 st.markdown(
@@ -60,7 +81,68 @@ def df_to_excel_bytes(df: pd.DataFrame) -> bytes:
     return buffer.getvalue()
 
 
-rooms_template_df = pd.DataFrame({'Кабинет': ['A101', 'A102', 'D201']})
+@st.cache_resource
+def get_upload_cache() -> LRUCache:
+    return LRUCache(maxsize=16)
+
+
+@st.cache_resource
+def get_result_cache():
+    if RESULT_DIR:
+        return DiskResultStore(RESULT_DIR, ttl=RESULT_TTL)
+    return LRUCache(maxsize=8)
+
+
+@st.cache_resource
+def get_job_executor():
+    # Shared by every session, so a burst of large requests queues instead of piling up.
+    if JOB_MODE == 'process':
+        # spawn: forking the threaded Streamlit server is not safe.
+        return ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=mp.get_context('spawn'))
+    return ThreadPoolExecutor(max_workers=JOB_WORKERS)
+
+
+@st.cache_resource
+def get_job_manager():
+    # Holds the progress/cancel state that worker processes share with the UI.
+    return mp.get_context('spawn').Manager()
+
+
+def start_allocation(rooms_file, students_file, settings, previous_file=None) -> Job:
+    upload_cache = get_upload_cache()
+    result_cache = get_result_cache()
+    rooms_hash = content_hash(rooms_file.getvalue())
+    students_hash = content_hash(students_file.getvalue())
+    previous_hash = content_hash(previous_file.getvalue()) if previous_file else None
+    # The worker count only changes speed, not the outcome, so it stays out of the key.
+    key_settings = {name: value for name, value in settings.items() if name != 'workers'}
+    key = content_hash(rooms_hash, students_hash, previous_hash, sorted(key_settings.items()))
+
+    cached = result_cache.get(key)
+    if cached is not None:
+        return Job.finished(cached)
+
+    uploads = {
+        'rooms': Upload(rooms_file.getvalue(), rooms_file.name, rooms_hash),
+        'students': Upload(students_file.getvalue(), students_file.name, students_hash),
+        'previous': Upload(previous_file.getvalue(), previous_file.name, previous_hash) if previous_file else None,
+    }
+    total = 1 if previous_file or settings['solver'] == 'flow' else settings['attempts']
+    if JOB_MODE == 'process':
+        # The Manager dict carries progress and cancellation across the process boundary.
+        return submit_job(
+            get_job_executor(), run_allocation, total, uploads, settings, result_cache, key, TRACE_MEMORY,
+            state=get_job_manager().dict(),
+        )
+    return submit_job(
+        get_job_executor(), run_allocation, total, uploads, settings, result_cache, key, TRACE_MEMORY, upload_cache
+    )
+
+
+# 'Орын саны' and 'Сынып шегі' are optional; blank cells use the settings below.
+rooms_template_df = pd.DataFrame(
+    {'Кабинет': ['A101', 'A102', 'D201'], 'Орын саны': [None, 15, None], 'Сынып шегі': [None, None, 2]}
+)
 students_template_df = pd.DataFrame(
     {
         'ИИН': ['123456789012', '234567890123', '345678901234'],
@@ -103,12 +185,18 @@ st.caption('Алдымен үлгілерді жүктеп алыңыз, дер
 
 col_left, col_right = st.columns(2)
 with col_left:
-    rooms_file = st.file_uploader('Кабинет файлы (.xlsx)', type=['xlsx'])
+    rooms_file = st.file_uploader('Кабинет файлы (.xlsx, .csv, .parquet)', type=UPLOAD_TYPES)
 with col_right:
-    students_file = st.file_uploader('Оқушылар файлы (.xlsx)', type=['xlsx'])
+    students_file = st.file_uploader('Оқушылар файлы (.xlsx, .csv, .parquet)', type=UPLOAD_TYPES)
+
+previous_file = st.file_uploader(
+    'Алдыңғы дайын тізім (міндетті емес, .xlsx)',
+    type=['xlsx'],
+    help='Жүктелсе, бұрын орналасқан оқушылар өз кабинетінде қалады, тек өзгерістер қайта бөлінеді.',
+)
 
 st.markdown('### Бөлу баптаулары')
-s1, s2, s3 = st.columns(3)
+s1, s2, s3, s4 = st.columns(4)
 with s1:
     max_per_room = st.number_input(
         'Кабинеттегі ең көп оқушы саны',
@@ -133,6 +221,53 @@ with s3:
         value=400,
         step=50,
     )
+with s4:
+    workers = st.number_input(
+        'Параллель процестер саны',
+        min_value=1,
+        max_value=os.cpu_count() or 1,
+        value=1,
+        step=1,
+    )
+
+m1, m2, m3 = st.columns([3, 1, 1])
+with m1:
+    solver = st.selectbox(
+        'Бөлу әдісі',
+        options=['greedy', 'flow'],
+        format_func=lambda value: {
+            'greedy': 'Кездейсоқ іздеу (әрекеттер бойынша)',
+            'flow': 'Дәл шешім (максималды ағын)',
+        }[value],
+    )
+with m2:
+    seed = st.number_input(
+        'Seed',
+        min_value=0,
+        value=0,
+        step=1,
+        help='Бірдей файлдар мен бірдей seed әрқашан бірдей нәтиже береді.',
+    )
+with m3:
+    refine_seconds = st.number_input(
+        'Теңестіру, с',
+        min_value=0.0,
+        max_value=30.0,
+        value=REFINE_SECONDS,
+        step=0.5,
+        help='Орналастырудан кейін кабинеттердің толуы мен сыныптардың араласуын теңестіруге берілетін уақыт (0 — өшірулі).',
+    )
+
+e1, e2 = st.columns(2)
+with e1:
+    table_format = st.selectbox(
+        'Жалпы кесте (басқа жүйелер үшін)',
+        options=[None, 'csv', 'parquet'],
+        format_func=lambda value: {None: 'Жоқ', 'csv': 'CSV', 'parquet': 'Parquet'}[value],
+        help='ИИН, Сыныбы, Тегі, Аты, Кабинет, № бағандары бар бір кесте.',
+    )
+with e2:
+    bundle = st.checkbox('Барлық файлды бір zip-ке жинау')
 
 run_clicked = st.button('Бөлу', type='primary', use_container_width=True)
 
@@ -140,50 +275,59 @@ if 'download_payloads' not in st.session_state:
     st.session_state.download_payloads = None
 if 'result_stats' not in st.session_state:
     st.session_state.result_stats = None
+if 'job' not in st.session_state:
+    st.session_state.job = None
 
 if run_clicked:
     if not rooms_file or not students_file:
         st.error('Екі файлды да жүктеңіз: кабинет және оқушылар файлы.')
     else:
-        try:
-            rooms_df = read_excel_from_upload(rooms_file)
-            students_df = read_excel_from_upload(students_file)
-            result = generate_outputs(
-                rooms_df,
-                students_df,
-                max_per_room=int(max_per_room),
-                max_per_class_in_room=int(max_per_class_in_room),
-                attempts=int(attempts),
-            )
-
-            ready_path = Path(result['ready_name'])
-            reference_path = Path(result['reference_name'])
-            payloads = {}
+        if st.session_state.job is not None:
+            st.session_state.job.cancel()
+        settings = {
+            'max_per_room': int(max_per_room),
+            'max_per_class_in_room': int(max_per_class_in_room),
+            'attempts': int(attempts),
+            'workers': int(workers),
+            'solver': solver,
+            'seed': int(seed),
+            'refine_seconds': float(refine_seconds),
+            'table_format': table_format,
+            'bundle': bundle,
+        }
+        st.session_state.download_payloads = None
+        st.session_state.result_stats = None
+        st.session_state.job = start_allocation(rooms_file, students_file, settings, previous_file)
 
-            with open(ready_path, 'rb') as f:
-                payloads['ready'] = {'name': ready_path.name, 'data': f.read()}
-
-            with open(reference_path, 'rb') as f:
-                payloads['reference'] = {'name': reference_path.name, 'data': f.read()}
-
-            if result['unassigned_name']:
-                unassigned_path = Path(result['unassigned_name'])
-                with open(unassigned_path, 'rb') as f:
-                    payloads['unassigned'] = {'name': unassigned_path.name, 'data': f.read()}
-
-            st.session_state.download_payloads = payloads
-            st.session_state.result_stats = {
-                'total_count': result['total_count'],
-                'assigned_count': result['assigned_count'],
-                'unassigned_count': result['unassigned_count'],
-            }
-
-            for fname in [result['ready_name'], result['reference_name'], result['unassigned_name']]:
-                if fname and os.path.exists(fname):
-                    os.remove(fname)
+job = st.session_state.job
+if job is not None and not job.done():
+    # A click on the cancel button reruns the script, which ends this polling loop.
+    if st.button('Тоқтату', key='cancel_job'):
+        job.cancel()
+        st.session_state.job = None
+        st.warning('Бөлу тоқтатылды.')
+    else:
+        progress_bar = st.progress(0.0)
+        while not job.done():
+            best = '—' if job.best_unassigned is None else job.best_unassigned
+            progress_bar.progress(
+                job.fraction,
+                text=f'Әрекет {job.attempt} / {job.total} · ең аз орналаспаған: {best}',
+            )
+            time.sleep(0.3)
+        st.rerun()
 
-        except Exception as e:
-            st.error(f'Қате: {e}')
+job = st.session_state.job
+if job is not None and job.done():
+    st.session_state.job = None
+    try:
+        payloads, stats = job.result()
+        st.session_state.download_payloads = payloads
+        st.session_state.result_stats = stats
+    except (JobCancelled, CancelledError):
+        st.warning('Бөлу тоқтатылды.')
+    except Exception as e:
+        st.error(f'Қате: {e}')
 
 if st.session_state.result_stats and st.session_state.download_payloads:
     stats = st.session_state.result_stats
@@ -196,6 +340,63 @@ if st.session_state.result_stats and st.session_state.download_payloads:
     c2.markdown(f"<div class='stat'><b>Орналасты:</b> {stats['assigned_count']}</div>", unsafe_allow_html=True)
     c3.markdown(f"<div class='stat'><b>Орналаспаған:</b> {stats['unassigned_count']}</div>", unsafe_allow_html=True)
 
+    if stats['churn']:
+        churn = stats['churn']
+        st.info(
+            f"Қайта бөлу: {churn['kept']} оқушы орнында қалды, {churn['moved']} ауыстырылды, "
+            f"{churn['new']} жаңа оқушы."
+        )
+
+    preflight = stats['preflight']
+    if preflight['lower_bound']:
+        reasons = []
+        if preflight['capacity_shortfall']:
+            reasons.append(
+                f"оқушылар саны барлық кабинеттер сыйымдылығынан ({preflight['capacity']}) "
+                f"{preflight['capacity_shortfall']}-ге артық"
+            )
+        for item in preflight['bottleneck_classes']:
+            reasons.append(
+                f"{item['class']} сыныбында {item['size']} оқушы, ал кабинеттерде бұл сыныпқа "
+                f"тек {item['room_slots']} орын бар"
+            )
+        if preflight.get('class_cap_shortfall'):
+            reasons.append(
+                f"кабинеттердегі бір сыныпқа арналған шектеулер ('Сынып шегі') салдарынан тағы "
+                f"{preflight['class_cap_shortfall']} оқушыға орын жетпейді"
+            )
+        st.warning(
+            f"Шектеулер бойынша кемінде {preflight['lower_bound']} оқушы орналаспайды"
+            + (': ' + '; '.join(reasons) + '.' if reasons else '.')
+        )
+
+    if stats['unassigned_is_minimum'] and stats['unassigned_count']:
+        st.info('Орналаспағандар саны — берілген шектеулер кезіндегі мүмкін болатын ең аз мән.')
+
+    diagnostics = stats['diagnostics']
+    with st.expander('Диагностика'):
+        st.caption(
+            f"Әрекеттер: {diagnostics.get('attempts_used')} · "
+            f"ең жақсы нәтиже {diagnostics.get('best_attempt')}-әрекетте табылды · "
+            f"барлығы {diagnostics['total_seconds']:.2f} с"
+        )
+        if 'refine_moves' in diagnostics:
+            st.caption(
+                f"Теңестіру: {diagnostics['refine_moves']} көшіру, {diagnostics['refine_swaps']} алмастыру"
+            )
+        stage_rows = [
+            {
+                'Кезең': stage['stage'],
+                'Уақыт, мс': round(stage['seconds'] * 1000, 1),
+                'Жад шыңы, МБ': round(stage['peak_bytes'] / 2**20, 1) if 'peak_bytes' in stage else None,
+                'RSS өсімі, МБ': (
+                    round(stage['rss_growth_bytes'] / 2**20, 1) if stage['rss_growth_bytes'] is not None else None
+                ),
+            }
+            for stage in diagnostics['stages']
+        ]
+        st.dataframe(pd.DataFrame(stage_rows), hide_index=True, use_container_width=True)
+
     st.markdown('### Жүктеу')
     st.download_button(
         label='Дайын тізімді жүктеу',
@@ -222,3 +423,21 @@ if st.session_state.result_stats and st.session_state.download_payloads:
             use_container_width=True,
             key='download_unassigned',
         )
+    if 'table' in payloads:
+        st.download_button(
+            label='Жалпы кестені жүктеу',
+            data=payloads['table']['data'],
+            file_name=payloads['table']['name'],
+            mime='text/csv' if payloads['table']['name'].endswith('.csv') else 'application/octet-stream',
+            use_container_width=True,
+            key='download_table',
+        )
+    if 'bundle' in payloads:
+        st.download_button(
+            label='Барлығын zip ретінде жүктеу',
+            data=payloads['bundle']['data'],
+            file_name=payloads['bundle']['name'],
+            mime='application/zip',
+            use_container_width=True,
+            key='download_bundle',
+        )
@@ -0,0 +1,322 @@
+"""Benchmark the allocator pipeline on synthetic data.
+
+Example:
+    python benchmark.py --students 8000 --classes 120 --rooms 320 --repeat 3 --output bench.json
+
+Every stage (ingest, allocate, optional refine, build sheets, write, optional table) is
+timed over --repeat runs and then run once more under tracemalloc for its peak memory;
+results are printed as JSON.
+
+With --sessions N it instead stress-tests concurrent use:
+    python benchmark.py --sessions 24 --job-workers 8 --students 3000 --rooms 150
+
+N sessions with different rosters are allocated at once through the app's job path
+(shared executor, upload cache and on-disk result store) while the same rosters are also
+saved into one shared directory. Every session's files must match a serial run of its own
+roster byte for byte; the exit code is 1 otherwise.
+
+With --repair-check it checks incremental repair instead:
+    python benchmark.py --repair-check --students 2000 --rooms 100 --seed 1 --repeat 5
+
+Each of --repeat rosters is allocated, then one room is dropped and five students of an
+existing class are added. Repairing from the previous ready list must leave exactly the
+preflight lower bound unassigned; the exit code is 1 otherwise.
+"""
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import allocator
+
+
+class _Upload:
+    def __init__(self, data: bytes, name: str):
+        self.name = name
+        self._data = data
+
+    def getvalue(self) -> bytes:
+        return self._data
+
+
+def make_students(students: int, classes: int, skew: float = 1.0, seed: int = 0) -> pd.DataFrame:
+    """Synthetic roster; class sizes follow a Zipf-like law, skew=0 gives equal classes."""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, classes + 1) ** skew
+    labels = np.array([f'{5 + i % 7}{chr(ord("A") + i // 7 % 26)}{i // 182 or ""}' for i in range(classes)])
+    class_codes = rng.choice(classes, size=students, p=weights / weights.sum())
+    return pd.DataFrame({
+        'ИИН': [f'{value:012d}' for value in rng.integers(0, 10**12, size=students)],
+        'Сыныбы': labels[class_codes],
+        'Тегі': [f'Тегі{i}' for i in rng.integers(0, 5000, size=students)],
+        'Аты': [f'Аты{i}' for i in rng.integers(0, 2000, size=students)],
+    })
+
+
+def make_rooms(rooms: int) -> pd.DataFrame:
+    return pd.DataFrame({'Кабинет': [f'{100 + i // 40 * 100 + i % 40}' for i in range(rooms)]})
+
+
+def _xlsx_bytes(df: pd.DataFrame) -> bytes:
+    buffer = BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def _measure(fn, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, {'seconds': min(timings), 'mean_seconds': sum(timings) / len(timings), 'peak_bytes': peak}
+
+
+def run_benchmark(args) -> dict:
+    students_df = make_students(args.students, args.classes, args.skew, args.seed)
+    rooms_df = make_rooms(args.rooms)
+    students_upload = _Upload(_xlsx_bytes(students_df), 'students.xlsx')
+    rooms_upload = _Upload(_xlsx_bytes(rooms_df), 'rooms.xlsx')
+
+    stages = {}
+    (rooms_df, students_df), stages['ingest'] = _measure(
+        lambda: (allocator.read_rooms_upload(rooms_upload), allocator.read_students_upload(students_upload)),
+        args.repeat,
+    )
+    available_rooms = rooms_df['Кабинет'].dropna().tolist()
+
+    placement, stages['allocate'] = _measure(
+        lambda: allocator.build_placement(
+            students_df,
+            available_rooms,
+            max_per_room=args.max_per_room,
+            max_per_class_in_room=args.max_per_class_in_room,
+            attempts=args.attempts,
+            workers=args.workers,
+            seed=args.seed,
+            solver=args.solver,
+        ),
+        args.repeat,
+    )
+    if args.refine_seconds:
+        placement, stages['refine'] = _measure(
+            lambda: allocator.refine_placement(
+                students_df,
+                len(available_rooms),
+                placement,
+                max_per_room=args.max_per_room,
+                max_per_class_in_room=args.max_per_class_in_room,
+                seconds=args.refine_seconds,
+            ),
+            args.repeat,
+        )
+    table = allocator._room_table(students_df, placement)
+    room_frames, stages['build_sheets'] = _measure(
+        lambda: allocator._build_room_frames(allocator._room_table(students_df, placement), available_rooms),
+        args.repeat,
+    )
+    # Styling happens while writing since the single-pass writer, so there is no separate format stage.
+    _, stages['write'] = _measure(
+        lambda: (
+            allocator._workbook_buffer(room_frames, allocator.READY_COLUMNS),
+            allocator._workbook_buffer(room_frames, allocator.REFERENCE_COLUMNS),
+        ),
+        args.repeat,
+    )
+
+    if args.table:
+        _, stages['table'] = _measure(
+            lambda: allocator._table_buffer(table, available_rooms, args.table), args.repeat
+        )
+
+    unassigned = int(np.count_nonzero(placement < 0))
+    for stage in stages.values():
+        stage['students_per_second'] = args.students / stage['seconds'] if stage['seconds'] else None
+
+    return {
+        'params': vars(args),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'excel_engine': allocator._excel_engine(),
+        },
+        'result': {'assigned': args.students - unassigned, 'unassigned': unassigned},
+        'stages': stages,
+        'total_seconds': sum(stage['seconds'] for stage in stages.values()),
+    }
+
+
+def _session_files(result) -> list:
+    return [result[f'{key}_buffer'].getvalue() for key in allocator.OUTPUT_FILES if result[f'{key}_buffer'] is not None]
+
+
+def run_sessions(args) -> dict:
+    from cache import DiskResultStore, LRUCache, content_hash
+    from jobs import submit_job
+    from worker import Upload, run_allocation
+
+    if args.refine_seconds is None:
+        # Like every production entry point, so the time-budgeted refine stage runs under load too.
+        args.refine_seconds = allocator.REFINE_SECONDS
+    settings = {
+        'max_per_room': args.max_per_room,
+        'max_per_class_in_room': args.max_per_class_in_room,
+        'attempts': args.attempts,
+        'workers': 1,
+        'solver': args.solver,
+        'seed': args.seed,
+        'refine_seconds': args.refine_seconds,
+        'table_format': args.table,
+        'bundle': False,
+    }
+    rooms_df = make_rooms(args.rooms)
+    rooms_data = rooms_df.to_csv(index=False).encode('utf-8')
+    rosters = [make_students(args.students, args.classes, args.skew, args.seed + index) for index in range(args.sessions)]
+    expected = [_session_files(allocator.generate_outputs(rooms_df, roster, **settings)) for roster in rosters]
+
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = DiskResultStore(Path(temp_dir) / 'results')
+        upload_cache = LRUCache(maxsize=4)
+        shared_dir = Path(temp_dir) / 'outputs'
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.job_workers) as executor:
+            jobs = []
+            saves = []
+            for index, roster in enumerate(rosters):
+                students_data = roster.to_csv(index=False).encode('utf-8')
+                uploads = {
+                    'rooms': Upload(rooms_data, 'rooms.csv', content_hash(rooms_data)),
+                    'students': Upload(students_data, 'students.csv', content_hash(students_data)),
+                }
+                key = content_hash(uploads['rooms'].key, uploads['students'].key, sorted(settings.items()))
+                jobs.append(submit_job(executor, run_allocation, 1, uploads, settings, store, key, False, upload_cache))
+                saves.append(executor.submit(
+                    allocator.generate_outputs, rooms_df, roster, output_dir=shared_dir, **settings
+                ))
+
+            for index, (job, save) in enumerate(zip(jobs, saves)):
+                payloads, _ = job.result()
+                files = [payloads[key]['data'] for key in allocator.OUTPUT_FILES if key in payloads]
+                if files != expected[index]:
+                    failures.append({'session': index, 'path': 'app'})
+                if [path.read_bytes() for path in save.result()['paths']] != expected[index]:
+                    failures.append({'session': index, 'path': 'output_dir'})
+        seconds = time.perf_counter() - start
+        files_written = sum(1 for _ in shared_dir.iterdir())
+
+    files_expected = sum(len(files) for files in expected)
+    if files_written != files_expected:
+        failures.append({'files_written': files_written, 'files_expected': files_expected})
+    return {
+        'params': vars(args),
+        'sessions': args.sessions,
+        'seconds': seconds,
+        'allocations_per_second': 2 * args.sessions / seconds,
+        'files_written': files_written,
+        'failures': failures,
+    }
+
+
+def run_repair_check(args) -> dict:
+    failures = []
+    for trial in range(args.repeat):
+        seed = args.seed + trial
+        students_df = make_students(args.students, args.classes, args.skew, seed)
+        rooms = make_rooms(args.rooms)['Кабинет'].tolist()
+        placement = allocator.build_placement(
+            students_df, rooms, args.max_per_room, args.max_per_class_in_room, attempts=args.attempts, seed=seed
+        )
+        names = np.array(rooms, dtype=object)
+        previous_df = pd.DataFrame({
+            'ИИН': students_df['ИИН'],
+            'Кабинет': np.where(placement >= 0, names[np.maximum(placement, 0)], None),
+        })
+        newcomers = make_students(5, 1, args.skew, seed + 10**6)
+        newcomers['Сыныбы'] = students_df['Сыныбы'].iloc[0]
+        students_df = pd.concat([students_df, newcomers], ignore_index=True)
+
+        repaired, churn = allocator.reallocate_placement(
+            students_df, rooms[1:], previous_df, args.max_per_room, args.max_per_class_in_room, seed=seed
+        )
+        lower_bound = allocator.preflight_check(
+            students_df, rooms[1:], args.max_per_room, args.max_per_class_in_room
+        )['lower_bound']
+        unassigned = int(np.count_nonzero(repaired < 0))
+        if unassigned != lower_bound:
+            failures.append({'seed': seed, 'unassigned': unassigned, 'lower_bound': lower_bound, **churn})
+    return {'params': vars(args), 'trials': args.repeat, 'failures': failures}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--classes', type=int, default=100)
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent for class sizes (0 = uniform)')
+    parser.add_argument('--rooms', type=int, default=300)
+    parser.add_argument('--max-per-room', type=int, default=23)
+    parser.add_argument('--max-per-class-in-room', type=int, default=3)
+    parser.add_argument('--attempts', type=int, default=400)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--solver', choices=allocator.SOLVERS, default='greedy')
+    parser.add_argument(
+        '--refine-seconds',
+        type=float,
+        help='also time refine_placement with this budget (--sessions: defaults to allocator.REFINE_SECONDS)',
+    )
+    parser.add_argument('--table', choices=allocator.TABLE_FORMATS, help='also time the flat table export')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--sessions', type=int, default=0, help='stress-test this many concurrent sessions instead')
+    parser.add_argument('--job-workers', type=int, default=4, help='shared job threads for --sessions')
+    parser.add_argument('--repair-check', action='store_true', help='check that repairs reach the lower bound instead')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.repair_check:
+        report = run_repair_check(args)
+    elif args.sessions:
+        report = run_sessions(args)
+    else:
+        report = run_benchmark(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.sessions:
+        print(f"{args.sessions} sessions in {report['seconds']:.1f} s, {len(report['failures'])} failures", file=sys.stderr)
+        return 1 if report['failures'] else 0
+    if args.repair_check:
+        print(f"{report['trials']} repairs, {len(report['failures'])} above the lower bound", file=sys.stderr)
+        return 1 if report['failures'] else 0
+
+    for name, stage in report['stages'].items():
+        print(
+            f"{name:>12}: {stage['seconds'] * 1000:9.1f} ms  {stage['peak_bytes'] / 2**20:8.1f} MiB peak",
+            file=sys.stderr,
+        )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
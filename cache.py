@@ -0,0 +1,122 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+def content_hash(*parts) -> str:
+    """Hash file bytes and settings into one stable key."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = repr(part).encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class _Cache:
+    def get_or_compute(self, key, compute):
+        # compute() runs outside any lock so a slow miss never blocks other sessions' hits.
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+
+class LRUCache(_Cache):
+    """Thread-safe mapping that keeps at most `maxsize` entries, evicting the least recently used."""
+
+    def __init__(self, maxsize: int = 16):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+class DiskResultStore(_Cache):
+    """Pickled values in a directory shared by every process, dropped `ttl` seconds after writing.
+
+    Entries are written to a temporary file and renamed into place, so readers in other
+    processes never see a partial value. Expired entries are removed on every put.
+
+    Values are unpickled and hold students' ИИН, so the directory is private (0700) and a
+    directory owned by another user is refused rather than trusted.
+    """
+
+    def __init__(self, directory, ttl: float = 3600):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if hasattr(os, 'getuid'):
+            info = self.directory.lstat()
+            if self.directory.is_symlink() or info.st_uid != os.getuid():
+                raise PermissionError(
+                    f'Result directory {self.directory} is a symlink or belongs to another user; '
+                    'set ALLOCATOR_RESULT_DIR to a private directory'
+                )
+            if info.st_mode & 0o077:
+                self.directory.chmod(0o700)
+
+    def _path(self, key) -> Path:
+        return self.directory / f'{content_hash(key)}.pkl'
+
+    def _expired(self, path: Path) -> bool:
+        return time.time() - path.stat().st_mtime > self.ttl
+
+    def __len__(self):
+        return sum(1 for _ in self.directory.glob('*.pkl'))
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            if self._expired(path):
+                path.unlink(missing_ok=True)
+                return default
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return default
+
+    def put(self, key, value):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+        self.evict_expired()
+
+    def evict_expired(self):
+        # A .tmp file older than the TTL belongs to a writer that died mid-put.
+        for path in [*self.directory.glob('*.pkl'), *self.directory.glob('*.tmp')]:
+            try:
+                if self._expired(path):
+                    path.unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,169 @@
+"""Command-line entry point for the room allocator.
+
+    python cli.py run Кабинет.xlsx students.xlsx --output-dir out/
+    python cli.py validate Кабинет.xlsx students.csv
+    python cli.py batch manifest.json --output results.zip --workers 8
+
+pandas, openpyxl and the allocator itself are imported only once a command needs them,
+so --help and argument errors return immediately. Exit codes: 0 success, 1 invalid
+input or failed batch job, 2 students left unassigned with --fail-on-unassigned.
+
+A batch manifest is a JSON list of jobs (or {"jobs": [...]}) or a CSV with one job per
+row. Each job names its 'rooms' and 'students' files, relative to the manifest, and may
+set 'name', 'previous' and generate_outputs settings such as max_per_room or
+table_format.
+"""
+import argparse
+import csv
+import json
+import sys
+from pathlib import Path
+
+
+PATH_FIELDS = ('rooms', 'students', 'previous')
+INT_FIELDS = ('max_per_room', 'max_per_class_in_room', 'attempts', 'workers', 'seed')
+FLOAT_FIELDS = ('refine_seconds',)
+BOOL_FIELDS = ('bundle',)
+
+
+def load_manifest(path) -> list:
+    path = Path(path)
+    if path.suffix.lower() == '.csv':
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            jobs = [{key: value for key, value in row.items() if value not in (None, '')} for row in csv.DictReader(f)]
+    else:
+        with open(path, encoding='utf-8-sig') as f:
+            jobs = json.load(f)
+        if isinstance(jobs, dict):
+            jobs = jobs['jobs']
+
+    for job in jobs:
+        for field in PATH_FIELDS:
+            if field in job:
+                job[field] = str(path.parent / job[field])
+        for field in INT_FIELDS:
+            if field in job:
+                job[field] = int(job[field])
+        for field in FLOAT_FIELDS:
+            if field in job:
+                job[field] = float(job[field])
+        for field in BOOL_FIELDS:
+            if isinstance(job.get(field), str):
+                job[field] = job[field].strip().lower() in ('1', 'true', 'yes')
+    return jobs
+
+
+def _read_inputs(args):
+    from allocator import read_rooms_upload, read_students_upload
+
+    return read_rooms_upload(args.rooms), read_students_upload(args.students)
+
+
+def run_validate(args) -> int:
+    rooms_df, students_df = _read_inputs(args)
+    rooms = rooms_df['Кабинет'].dropna()
+    print(f"OK: {len(rooms)} rooms, {len(students_df)} students, {students_df['Сыныбы'].nunique()} classes")
+    return 0
+
+
+def run_allocation(args) -> int:
+    from allocator import generate_outputs, read_previous_assignment
+
+    rooms_df, students_df = _read_inputs(args)
+    previous_df = read_previous_assignment(args.previous) if args.previous else None
+    result = generate_outputs(
+        rooms_df,
+        students_df,
+        max_per_room=args.max_per_room,
+        max_per_class_in_room=args.max_per_class_in_room,
+        attempts=args.attempts,
+        workers=args.workers,
+        solver=args.solver,
+        seed=args.seed,
+        refine_seconds=args.refine_seconds,
+        table_format=args.table,
+        bundle=args.bundle,
+        output_dir=args.output_dir,
+        previous_df=previous_df,
+    )
+
+    if args.json:
+        summary = {key: value for key, value in result.items() if not key.endswith('_buffer')}
+        print(json.dumps(summary, ensure_ascii=False, default=str, indent=2))
+    else:
+        print(f"Placed {result['assigned_count']} of {result['total_count']}, unassigned {result['unassigned_count']}")
+        for path in result['paths']:
+            print(path)
+
+    if args.fail_on_unassigned and result['unassigned_count']:
+        return 2
+    return 0
+
+
+def run_batch(args) -> int:
+    from allocator import generate_batch_outputs
+
+    jobs = load_manifest(args.manifest)
+    result = generate_batch_outputs(jobs, archive=args.output, workers=args.workers)
+    failed = 0
+    for summary in result['jobs']:
+        if 'error' in summary:
+            failed += 1
+            print(f"{summary['name']}: {summary['error']}", file=sys.stderr)
+        else:
+            print(f"{summary['name']}: {summary['assigned_count']}/{summary['total_count']} placed")
+    print(f'Archive: {args.output}')
+    return 1 if failed else 0
+
+
+def _add_input_arguments(parser):
+    parser.add_argument('rooms', help="rooms file (.xlsx, .csv, .parquet) with a 'Кабинет' column")
+    parser.add_argument('students', help='students file (.xlsx, .csv, .parquet): ИИН, Сыныбы, Тегі, Аты')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Allocate students to exam rooms.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='allocate one rooms/students pair and write the workbooks')
+    _add_input_arguments(run)
+    run.add_argument('--output-dir', '-o', default='.', help='directory for the output workbooks')
+    run.add_argument('--max-per-room', type=int, default=23)
+    run.add_argument('--max-per-class-in-room', type=int, default=3)
+    run.add_argument('--attempts', type=int, default=400)
+    run.add_argument('--workers', type=int, default=1)
+    run.add_argument('--solver', choices=('greedy', 'flow'), default='greedy')
+    # Same as allocator.REFINE_SECONDS (not imported here so that --help stays instant).
+    run.add_argument('--refine-seconds', type=float, default=1.0, help='time budget for balancing rooms (0 = off)')
+    run.add_argument('--seed', type=int, help='fix the random choices; same inputs and seed give identical files')
+    run.add_argument('--previous', help='earlier ready list to repair incrementally')
+    run.add_argument('--table', choices=('csv', 'parquet'), help='also write a flat ИИН/…/Кабинет/№ table')
+    run.add_argument('--bundle', action='store_true', help='also write every output file into one zip')
+    run.add_argument('--json', action='store_true', help='print the result summary as JSON')
+    run.add_argument('--fail-on-unassigned', action='store_true', help='exit with 2 if anyone is left over')
+    run.set_defaults(handler=run_allocation)
+
+    validate = commands.add_parser('validate', help='only read and check the input files')
+    _add_input_arguments(validate)
+    validate.set_defaults(handler=run_validate)
+
+    batch = commands.add_parser('batch', help='run every job of a manifest and zip all outputs')
+    batch.add_argument('manifest', help='JSON or CSV manifest of jobs')
+    batch.add_argument('--output', '-o', default='allocations.zip', help='zip archive to write')
+    batch.add_argument('--workers', type=int, default=None, help='parallel processes (default: all cores)')
+    batch.set_defaults(handler=run_batch)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except (ValueError, FileNotFoundError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
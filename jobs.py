@@ -0,0 +1,81 @@
+from concurrent.futures import Future
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once the user has cancelled it."""
+
+
+class Progress:
+    """Progress callback handed to a job; raises JobCancelled once the job is cancelled.
+
+    `state` is a plain dict for jobs on threads, or a multiprocessing Manager dict so that a
+    job in a worker process can report back and see cancellation.
+    """
+
+    def __init__(self, state):
+        self.state = state
+
+    def __call__(self, attempt, best_unassigned):
+        if self.state['cancelled']:
+            raise JobCancelled()
+        self.state.update(attempt=attempt, best_unassigned=best_unassigned)
+
+
+class Job:
+    """Handle for an allocation running on a shared executor.
+
+    The job's function receives `job.report` as its progress callback; the UI polls
+    `attempt` / `best_unassigned` and may call `cancel()` at any time.
+    """
+
+    def __init__(self, total: int, state=None):
+        self.total = max(1, total)
+        self.future = None
+        self._state = {} if state is None else state
+        self._state.update(attempt=0, best_unassigned=None, cancelled=False)
+        self.report = Progress(self._state)
+
+    @classmethod
+    def finished(cls, value):
+        job = cls(total=1)
+        job._state['attempt'] = job.total
+        job.future = Future()
+        job.future.set_result(value)
+        return job
+
+    @property
+    def attempt(self) -> int:
+        return self._state['attempt']
+
+    @property
+    def best_unassigned(self):
+        return self._state['best_unassigned']
+
+    @property
+    def cancelled(self) -> bool:
+        return self._state['cancelled']
+
+    @property
+    def fraction(self) -> float:
+        return min(1.0, self.attempt / self.total)
+
+    def cancel(self):
+        self._state['cancelled'] = True
+        if self.future is not None:
+            self.future.cancel()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+
+def submit_job(executor, fn, total: int, *args, state=None) -> Job:
+    """Run fn(progress, *args) on `executor` and return its Job handle.
+
+    For a process pool, pass a Manager dict as `state` and a module-level `fn`.
+    """
+    job = Job(total, state)
+    job.future = executor.submit(fn, job.report, *args)
+    return job
@@ -0,0 +1,82 @@
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+logger = logging.getLogger('allocator.trace')
+# tracemalloc is process-wide: memory-traced stages of concurrent jobs take turns instead of
+# resetting and stopping each other's tracing.
+_tracemalloc_lock = threading.RLock()
+
+
+def _max_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Tracer:
+    """Collects wall time and memory per pipeline stage plus free-form run facts.
+
+    With memory=True, tracemalloc records each stage's peak Python allocation; it slows
+    allocation-heavy code and makes traced stages of concurrent jobs run one at a time, so
+    it is opt-in. How much a stage raised the process RSS high-water mark is always recorded
+    (process-wide, so concurrent jobs add to each other's growth).
+    """
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.stages = []
+        self.info = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        with _tracemalloc_lock if self.memory else nullcontext():
+            started_tracing = self.memory and not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            if self.memory:
+                tracemalloc.reset_peak()
+            rss_before = _max_rss_bytes()
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                record = {'stage': name, 'seconds': time.perf_counter() - start, 'rss_growth_bytes': None}
+                if rss_before is not None:
+                    record['rss_growth_bytes'] = _max_rss_bytes() - rss_before
+                if self.memory:
+                    record['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+                self.stages.append(record)
+
+    def to_dict(self) -> dict:
+        return {
+            'stages': list(self.stages),
+            'total_seconds': sum(stage['seconds'] for stage in self.stages),
+            **self.info,
+        }
+
+    def emit(self, **context):
+        """Log the diagnostics as a single JSON line on the 'allocator.trace' logger."""
+        logger.info(json.dumps({**context, **self.to_dict()}, ensure_ascii=False, default=str))
+
+
+def enable_json_log(stream=None):
+    """Print trace records (one JSON object per line) to `stream`, stderr by default."""
+    if not any(getattr(handler, '_allocator_trace', False) for handler in logger.handlers):
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler._allocator_trace = True
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
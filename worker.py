@@ -0,0 +1,57 @@
+"""Allocation jobs for the Streamlit app, runnable on a thread or in a worker process.
+
+The UI hands over the raw upload bytes and the settings; run_allocation parses them,
+runs generate_outputs, stores (payloads, stats) in the result store under `key` and
+returns them. Everything it receives is picklable, so the same function serves the
+in-process thread pool and the process pool of the production profile.
+"""
+from allocator import OUTPUT_FILES, generate_outputs, read_previous_assignment, read_rooms_upload, read_students_upload
+from tracing import Tracer
+
+
+class Upload:
+    """File bytes with a name (for the format) and a content hash (for caching)."""
+
+    def __init__(self, data: bytes, name: str, key: str):
+        self.name = name
+        self.key = key
+        self._data = data
+
+    def getvalue(self) -> bytes:
+        return self._data
+
+
+def _read(kind, upload, reader, upload_cache):
+    if upload_cache is None:
+        return reader(upload)
+    return upload_cache.get_or_compute((kind, upload.key), lambda: reader(upload))
+
+
+def run_allocation(progress, uploads, settings, store, key, trace_memory=False, upload_cache=None):
+    """Allocate one request; `uploads` maps 'rooms', 'students' and optionally 'previous' to Uploads."""
+    tracer = Tracer(memory=trace_memory)
+    with tracer.stage('ingest'):
+        rooms_df = _read('rooms', uploads['rooms'], read_rooms_upload, upload_cache)
+        students_df = _read('students', uploads['students'], read_students_upload, upload_cache)
+        previous_df = None
+        if uploads.get('previous') is not None:
+            previous_df = _read('previous', uploads['previous'], read_previous_assignment, upload_cache)
+
+    result = generate_outputs(
+        rooms_df, students_df, progress=progress, tracer=tracer, previous_df=previous_df, **settings
+    )
+    payloads = {}
+    for name in OUTPUT_FILES:
+        if result[f'{name}_buffer'] is not None:
+            payloads[name] = {'name': result[f'{name}_name'], 'data': result[f'{name}_buffer'].getvalue()}
+    stats = {
+        'total_count': result['total_count'],
+        'assigned_count': result['assigned_count'],
+        'unassigned_count': result['unassigned_count'],
+        'unassigned_is_minimum': result['unassigned_is_minimum'],
+        'diagnostics': result['diagnostics'],
+        'churn': result['churn'],
+        'preflight': result['preflight'],
+    }
+    store.put(key, (payloads, stats))
+    return payloads, stats